@@ -0,0 +1,96 @@
+# cache_embeddings.py
+"""
+Hash del texto, normalización y caché Redis de embeddings
+
+Compartido por generate_embeddings.py y la API: ambos calculan igual el hash
+del texto (producto_embeddings.texto_sha) y las claves de caché, así que cada
+uno reutiliza los embeddings que ha generado el otro.
+"""
+
+import hashlib
+import logging
+
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+def normalizar(embedding):
+    """Normalizar un embedding a norma 1
+
+    Con vectores unitarios la similitud coseno es el producto escalar, así que
+    la búsqueda puede ordenar por <#> sin calcular normas por fila.
+
+    Args:
+        embedding (list): Embedding devuelto por Ollama
+
+    Returns:
+        numpy.ndarray: Embedding float32 normalizado
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def hash_texto(modelo, texto):
+    """SHA-256 del modelo y el texto embebido
+
+    Se guarda en producto_embeddings.texto_sha para no regenerar embeddings
+    cuyo texto (y modelo) no han cambiado, y es la base de la clave de caché.
+
+    Args:
+        modelo (str): Modelo de embeddings
+        texto (str): Texto embebido
+
+    Returns:
+        bytes: Digest SHA-256
+    """
+    return hashlib.sha256(f"{modelo}:{texto}".encode()).digest()
+
+
+def clave_cache(modelo, texto):
+    """Clave de caché Redis de un texto"""
+    return 'emb:' + hash_texto(modelo, texto).hex()
+
+
+def leer_cache(redis_client, modelo, textos):
+    """Buscar embeddings en la caché Redis
+
+    Args:
+        redis_client (redis.Redis): Cliente Redis, o None si no hay caché
+        modelo (str): Modelo de embeddings
+        textos (list): Textos a buscar
+
+    Returns:
+        list: Embedding de cada texto, o None en los que no están en caché
+    """
+    if redis_client is None:
+        return [None] * len(textos)
+    try:
+        valores = redis_client.mget([clave_cache(modelo, texto) for texto in textos])
+    except redis.RedisError as e:
+        logger.warning("Caché Redis no disponible: %s", e)
+        return [None] * len(textos)
+    # Los vectores se guardan como float32 crudos (4 bytes por dimensión)
+    return [np.frombuffer(valor, dtype=np.float32) if valor else None for valor in valores]
+
+
+def guardar_cache(redis_client, ttl, modelo, textos, embeddings):
+    """Guardar embeddings en la caché Redis con expiración
+
+    Args:
+        redis_client (redis.Redis): Cliente Redis, o None si no hay caché
+        ttl (int): Segundos hasta que expira cada entrada
+        modelo (str): Modelo de embeddings
+        textos (list): Textos embebidos
+        embeddings (list): Embedding de cada texto
+    """
+    if redis_client is None:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for texto, embedding in zip(textos, embeddings):
+            pipe.setex(clave_cache(modelo, texto), ttl, np.asarray(embedding, dtype=np.float32).tobytes())
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("No se pudo guardar en la caché Redis: %s", e)
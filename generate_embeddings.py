@@ -1,10 +1,24 @@
 # generate_embeddings.py
-import psycopg2
+from psycopg2.extras import execute_values, NamedTupleCursor
+from psycopg2.pool import ThreadedConnectionPool
+from pgvector.psycopg2 import register_vector
 import ollama
-import time
+import httpx
+import asyncio
+import atexit
 import os
+import io
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import json
+from functools import lru_cache
+import redis
 from dotenv import load_dotenv
 
+# Usa la extensión compilada con mypyc si existe (make compile)
+from texto_producto import TEXTO_SQL, preparar_textos_lote
+from cache_embeddings import normalizar, hash_texto, leer_cache, guardar_cache
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -19,163 +33,533 @@ DB_CONFIG = {
 
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'all-minilm')
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 32))
+MAX_CONCURRENCIA = int(os.getenv('MAX_CONCURRENCIA', 4))
+MAX_REINTENTOS = int(os.getenv('MAX_REINTENTOS', 3))
+
+# Caché de embeddings en Redis (opcional): sin REDIS_URL solo se usa la caché en memoria
+REDIS_URL = os.getenv('REDIS_URL')
+CACHE_TTL = int(os.getenv('CACHE_TTL', 7 * 86400))
+
+# Memoria para reconstruir el índice vectorial tras una regeneración completa
+MAINTENANCE_WORK_MEM = os.getenv('MAINTENANCE_WORK_MEM', '512MB')
+
+# Índice HNSW de búsqueda (mismo que en init-db.sql y las migraciones)
+INDICE_VECTOR_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_producto_embeddings_vector
+    ON producto_embeddings
+    USING hnsw (embedding halfvec_ip_ops)
+"""
+
+# Respuestas de Ollama que indican saturación (cola llena, servicio ocupado)
+CODIGOS_REINTENTABLES = {429, 503}
+
+# Cliente de Ollama compartido: reutiliza la conexión HTTP entre lotes
+ollama_client = ollama.Client(host=OLLAMA_HOST)
+
+# Cliente asíncrono para enviar varios lotes en paralelo durante la generación
+ollama_async_client = ollama.AsyncClient(
+    host=OLLAMA_HOST,
+    limits=httpx.Limits(max_keepalive_connections=40, max_connections=100)
+)
+
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Dimensión usada si no se puede consultar el modelo (all-minilm)
+DIMENSION_POR_DEFECTO = 384
+
+
+def obtener_dimension_embedding():
+    """Obtener la dimensión de los embeddings del modelo configurado
+
+    Se consulta a Ollama una sola vez y se guarda en
+    ~/.cache/inventario/embed_dim_<modelo>.json para las siguientes ejecuciones.
+
+    Returns:
+        int: Número de dimensiones de los embeddings
+    """
+    ruta = os.path.join(
+        os.path.expanduser('~'), '.cache', 'inventario',
+        f"embed_dim_{OLLAMA_MODEL.replace('/', '_')}.json"
+    )
+    try:
+        with open(ruta) as f:
+            return json.load(f)['dim']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    try:
+        response = ollama_client.embed(model=OLLAMA_MODEL, input="x")
+        dimension = len(response['embeddings'][0])
+    except Exception as e:
+        print(f"⚠ No se pudo consultar la dimensión de {OLLAMA_MODEL}, usando {DIMENSION_POR_DEFECTO}: {e}")
+        return DIMENSION_POR_DEFECTO
+
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w') as f:
+            json.dump({'model': OLLAMA_MODEL, 'dim': dimension}, f)
+    except OSError as e:
+        print(f"⚠ No se pudo guardar la dimensión en {ruta}: {e}")
+    return dimension
+
+
+EMBED_DIM = obtener_dimension_embedding()
+
+
+# Pool de conexiones: evita un handshake con PostgreSQL por cada operación
+db_pool = ThreadedConnectionPool(1, 8, **DB_CONFIG)
+atexit.register(db_pool.closeall)
+
+# Los tipos de pgvector se registran una sola vez para todo el proceso
+_tipos_vector_registrados = False
 
 
 def conectar_db():
-    """Conectar a PostgreSQL"""
-    return psycopg2.connect(**DB_CONFIG)
+    """Obtener una conexión del pool con el tipo vector de pgvector registrado"""
+    global _tipos_vector_registrados
+    conn = db_pool.getconn()
+    if not _tipos_vector_registrados:
+        # Permite pasar arrays de numpy directamente como parámetros vector/halfvec
+        register_vector(conn, globally=True)
+        _tipos_vector_registrados = True
+    return conn
 
 
-def generar_embedding(texto):
-    """Generar embedding usando Ollama"""
+def liberar_db(conn):
+    """Devolver una conexión al pool"""
+    db_pool.putconn(conn)
+
+
+def generar_embeddings_batch(textos):
+    """Generar embeddings para varios textos en una sola llamada a /api/embed
+
+    Solo se envían a Ollama los textos que no están en la caché Redis.
+
+    Args:
+        textos (list): Textos a embeber
+
+    Returns:
+        list: Embeddings en el mismo orden que los textos, o None si hay error
+    """
     try:
-        # Configurar cliente de Ollama si se especifica un host personalizado
-        client = ollama.Client(host=OLLAMA_HOST)
-        response = client.embed(
-            model=OLLAMA_MODEL,
-            input=texto
-        )
-        return response['embeddings'][0]
+        embeddings = leer_cache(redis_client, OLLAMA_MODEL, textos)
+        pendientes = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if pendientes:
+            textos_pendientes = [textos[i] for i in pendientes]
+            response = ollama_client.embed(
+                model=OLLAMA_MODEL,
+                input=textos_pendientes
+            )
+            for i, embedding in zip(pendientes, response['embeddings']):
+                embeddings[i] = embedding
+            guardar_cache(redis_client, CACHE_TTL, OLLAMA_MODEL, textos_pendientes, response['embeddings'])
+        return embeddings
     except Exception as e:
-        print(f"Error generando embedding: {e}")
+        print(f"Error generando embeddings: {e}")
         return None
 
 
-def preparar_texto_producto(producto):
-    """Preparar texto descriptivo del producto para embedding con énfasis semántico"""
-    # Repetir información clave para aumentar el peso semántico
-    nombre = producto['nombre']
-    categoria = producto.get('categoria', '')
-    descripcion = producto.get('descripcion', '')
-
-    # Construir texto con repetición estratégica del nombre y categoría
-    texto_parts = [
-        f"{nombre}",  # Nombre al inicio (mayor peso)
-        f"Producto: {nombre}",  # Repetir nombre
-        f"Categoría: {categoria}" if categoria else "",
-        f"Tipo: {categoria}" if categoria else "",  # Repetir categoría
-        f"{descripcion}" if descripcion else "",
-        f"Código: {producto['codigo']}",
-        f"Proveedor: {producto['proveedor']}" if producto.get('proveedor') else ""
+@lru_cache(maxsize=1024)
+def _embedding_cacheado(texto):
+    """Caché en memoria delante de Redis y Ollama"""
+    embeddings = generar_embeddings_batch([texto])
+    if not embeddings:
+        # Lanzar en lugar de devolver None para que el fallo no quede cacheado
+        raise LookupError(texto)
+    embedding = normalizar(embeddings[0])
+    # Solo lectura: el mismo array se devuelve en cada acierto de la caché
+    embedding.flags.writeable = False
+    return embedding
+
+
+def generar_embedding(texto):
+    """Generar embedding usando Ollama (con caché en memoria y en Redis)
+
+    Returns:
+        numpy.ndarray: Embedding float32 normalizado (solo lectura), o None si hay error
+    """
+    try:
+        return _embedding_cacheado(texto)
+    except LookupError:
+        return None
+
+
+async def embeber_lote(semaforo, lote, textos, descripcion):
+    """Generar los embeddings de un lote limitando las peticiones simultáneas
+
+    Args:
+        semaforo (asyncio.Semaphore): Límite de lotes en vuelo contra Ollama
+        lote (list): Productos del lote
+        textos (list): Textos preparados de cada producto
+        descripcion (str): Rango del lote para los mensajes
+
+    Returns:
+        tuple: (lote, textos, embeddings); embeddings es None si hay error
+    """
+    async with semaforo:
+        embeddings = leer_cache(redis_client, OLLAMA_MODEL, textos)
+        pendientes = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not pendientes:
+            print(f"✓ Embeddings de productos {descripcion} obtenidos de la caché")
+            return lote, textos, embeddings
+
+        print(f"Generando embeddings para productos {descripcion}")
+        textos_pendientes = [textos[i] for i in pendientes]
+        for intento in range(MAX_REINTENTOS + 1):
+            try:
+                response = await ollama_async_client.embed(
+                    model=OLLAMA_MODEL,
+                    input=textos_pendientes
+                )
+                break
+            except ollama.ResponseError as e:
+                # Si Ollama está saturado esperar con backoff exponencial
+                if e.status_code in CODIGOS_REINTENTABLES and intento < MAX_REINTENTOS:
+                    espera = 0.5 * 2 ** intento
+                    print(f"⚠ Ollama ocupado ({e.status_code}), reintentando lote {descripcion} en {espera}s")
+                    await asyncio.sleep(espera)
+                    continue
+                print(f"✗ Error generando embeddings para el lote {descripcion}: {e}")
+                return lote, textos, None
+            except Exception as e:
+                print(f"✗ Error generando embeddings para el lote {descripcion}: {e}")
+                return lote, textos, None
+
+        for i, embedding in zip(pendientes, response['embeddings']):
+            embeddings[i] = embedding
+        guardar_cache(redis_client, CACHE_TTL, OLLAMA_MODEL, textos_pendientes, response['embeddings'])
+        return lote, textos, embeddings
+
+
+def preparar_upsert(cur):
+    """Preparar el upsert de un embedding en la conexión del cursor
+
+    Las conexiones del pool se reutilizan, así que antes de preparar se
+    comprueba si la sesión ya tiene la sentencia.
+
+    Args:
+        cur: Cursor de PostgreSQL
+    """
+    cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = 'embed_upsert'")
+    if cur.fetchone():
+        return
+    cur.execute(f"""
+        PREPARE embed_upsert(integer, halfvec({EMBED_DIM}), text, bytea) AS
+        INSERT INTO producto_embeddings (producto_id, embedding, texto_embebido, texto_sha)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (producto_id) DO UPDATE SET
+            embedding = EXCLUDED.embedding,
+            texto_embebido = EXCLUDED.texto_embebido,
+            texto_sha = EXCLUDED.texto_sha,
+            fecha_generacion = CURRENT_TIMESTAMP
+    """)
+
+
+def guardar_embeddings(cur, filas):
+    """Guardar un lote de embeddings con un único INSERT multi-fila (upsert)
+
+    Un lote de una sola fila usa la sentencia preparada (preparar_upsert),
+    sin volver a analizar el SQL.
+
+    Args:
+        cur: Cursor de PostgreSQL
+        filas (list): Tuplas (producto_id, embedding, texto, texto_sha)
+    """
+    if len(filas) == 1:
+        cur.execute("EXECUTE embed_upsert(%s, %s, %s, %s)", filas[0])
+        return
+
+    execute_values(cur, """
+        INSERT INTO producto_embeddings (producto_id, embedding, texto_embebido, texto_sha)
+        VALUES %s
+        ON CONFLICT (producto_id) DO UPDATE SET
+            embedding = EXCLUDED.embedding,
+            texto_embebido = EXCLUDED.texto_embebido,
+            texto_sha = EXCLUDED.texto_sha,
+            fecha_generacion = CURRENT_TIMESTAMP
+    """, filas, template=f"(%s, %s::halfvec({EMBED_DIM}), %s, %s)", page_size=100)
+
+
+# Cabecera (firma, flags y extensión vacías) y marca de fin del COPY binario
+COPY_CABECERA = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+COPY_FIN = struct.pack('!h', -1)
+
+
+def copiar_embeddings(cur, filas):
+    """Cargar un lote de embeddings con COPY binario (tabla recién vaciada)
+
+    Los vectores viajan como fp16 crudo (2 bytes por dimensión) en lugar de
+    su representación de texto, sin formatear floats en Python.
+
+    Args:
+        cur: Cursor de PostgreSQL
+        filas (list): Tuplas (producto_id, embedding, texto, texto_sha)
+    """
+    buffer = io.BytesIO()
+    buffer.write(COPY_CABECERA)
+    for producto_id, embedding, texto, texto_sha in filas:
+        # halfvec binario: dimensión (int16), campo sin uso (int16) y valores fp16 big-endian
+        vector = struct.pack('!hh', len(embedding), 0) + embedding.astype('>f2').tobytes()
+        texto_bytes = texto.encode('utf-8')
+        # 4 columnas; producto_id es un int4 (4 bytes)
+        buffer.write(struct.pack('!hii', 4, 4, producto_id))
+        buffer.write(struct.pack('!i', len(vector)))
+        buffer.write(vector)
+        buffer.write(struct.pack('!i', len(texto_bytes)))
+        buffer.write(texto_bytes)
+        buffer.write(struct.pack('!i', len(texto_sha)))
+        buffer.write(texto_sha)
+    buffer.write(COPY_FIN)
+    buffer.seek(0)
+    cur.copy_expert(
+        "COPY producto_embeddings (producto_id, embedding, texto_embebido, texto_sha) FROM STDIN WITH (FORMAT BINARY)",
+        buffer
+    )
+
+
+def guardar_lote(conn, cur, resultado, forzar):
+    """Guardar en la base de datos el resultado de un lote ya embebido
+
+    Args:
+        conn: Conexión de escritura
+        cur: Cursor de la conexión de escritura
+        resultado (tuple): (lote, textos, embeddings) devuelto por embeber_lote
+        forzar (bool): Si la tabla se vació antes de la carga
+
+    Returns:
+        int: Número de embeddings guardados
+    """
+    lote, textos, embeddings = resultado
+    if not embeddings:
+        return 0
+
+    filas = [
+        (producto.id, normalizar(embedding), texto, hash_texto(OLLAMA_MODEL, texto))
+        for producto, texto, embedding in zip(lote, textos, embeddings)
     ]
-    return " ".join(filter(None, texto_parts))
 
+    # Tras el borrado la tabla está vacía: COPY evita el parseo de INSERTs
+    if forzar:
+        copiar_embeddings(cur, filas)
+    else:
+        guardar_embeddings(cur, filas)
+
+    conn.commit()
+    print(f"✓ {len(filas)} embeddings guardados")
+    return len(filas)
+
+
+def crear_indice_vector(conn):
+    """Construir el índice HNSW de una vez tras la carga masiva
+
+    Args:
+        conn: Conexión a PostgreSQL (sin transacción abierta con errores)
+    """
+    print("Reconstruyendo índice vectorial...")
+    with conn.cursor() as cur:
+        # SET LOCAL: no deja el valor en la conexión que vuelve al pool
+        cur.execute("SET LOCAL maintenance_work_mem = %s", (MAINTENANCE_WORK_MEM,))
+        cur.execute(INDICE_VECTOR_SQL)
+    conn.commit()
+    print("✓ Índice vectorial reconstruido")
+
+
+# Espacio de los advisory locks con los que los generadores se reparten productos
+CLAVE_BLOQUEO_EMBEDDINGS = 0x454D42
+
+
+def reclamar_lote(conn, ultimo_id):
+    """Reclamar el siguiente lote de productos sin embedding o con texto modificado
+
+    Cada producto se reclama con un advisory lock de sesión (pg_try_advisory_lock),
+    que no bloquea las filas: la API puede actualizar o eliminar productos
+    mientras se generan sus embeddings. Los productos reclamados por otro
+    generador se saltan. La transacción de lectura se confirma enseguida y los
+    locks del lote se liberan con liberar_lote en cuanto se ha guardado.
+
+    Args:
+        conn: Conexión de lectura (la misma durante todo el proceso)
+        ultimo_id (int): Mayor id del lote anterior (paginación por clave)
+
+    Returns:
+        tuple: (productos reclamados, mayor id visto o None si no quedan productos)
+    """
+    with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+        # Productos sin embedding o cuyo texto ha cambiado desde que se generó
+        # (el hash del texto actual no coincide con texto_sha)
+        cur.execute(f"""
+                    WITH candidatos AS MATERIALIZED (
+                        SELECT p.id, p.codigo, p.nombre, p.descripcion, p.categoria, p.proveedor
+                        FROM productos p
+                                 LEFT JOIN producto_embeddings pe
+                                           ON pe.producto_id = p.id
+                                          AND pe.texto_sha = sha256(convert_to(%s || ':' || ({TEXTO_SQL}), 'UTF8'))
+                        WHERE pe.id IS NULL
+                          AND p.activo = true
+                          AND p.id > %s
+                        ORDER BY p.id
+                        LIMIT %s
+                    )
+                    SELECT *, pg_try_advisory_lock(%s, id) AS reclamado
+                    FROM candidatos
+                    """, (OLLAMA_MODEL, ultimo_id, BATCH_SIZE, CLAVE_BLOQUEO_EMBEDDINGS))
+        filas = cur.fetchall()
+    conn.commit()
+
+    if not filas:
+        return [], None
+    return [fila for fila in filas if fila.reclamado], filas[-1].id
+
+
+def liberar_lote(conn, lote):
+    """Liberar los advisory locks de un lote ya guardado o cuyo embedding falló
+
+    Los locks de sesión ocupan la tabla de locks compartida del servidor, así
+    que no deben acumularse durante toda la ejecución.
+
+    Args:
+        conn: Conexión de lectura (la que reclamó el lote)
+        lote (list): Productos reclamados por reclamar_lote
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT pg_advisory_unlock(%s, id) FROM unnest(%s::int[]) AS id",
+            (CLAVE_BLOQUEO_EMBEDDINGS, [producto.id for producto in lote])
+        )
+    conn.commit()
+
+
+async def generar_embeddings_productos(forzar=False):
+    """Generar embeddings para los productos sin embedding o con texto modificado
 
-def generar_embeddings_productos(forzar=False):
-    """Generar embeddings para todos los productos sin embedding
+    Los productos se leen por lotes (reclamar_lote), de modo que varios
+    procesos pueden repartirse el trabajo sin bloquear las filas de productos.
+    Los lotes se envían a Ollama de forma concurrente (hasta MAX_CONCURRENCIA)
+    y un hilo escritor los guarda a medida que van terminando, solapando la
+    escritura con la inferencia.
 
     Args:
-        forzar (bool): Si es True, regenera todos los embeddings aunque ya existan
+        forzar (bool): Si es True, regenera todos los embeddings aunque ya existan.
+            El índice vectorial se elimina antes de la carga y se construye al
+            final, más rápido que actualizar el grafo HNSW en cada inserción
     """
+    # Conexión de lectura (mantiene los advisory locks de los lotes en curso)
+    # y conexión de escritura (confirma cada lote por separado)
+    conn_lectura = conectar_db()
     conn = conectar_db()
     cur = conn.cursor()
 
     try:
         if forzar:
             print("FORZANDO regeneración de TODOS los embeddings...")
-            # Eliminar todos los embeddings existentes
+            # Eliminar todos los embeddings existentes y el índice vectorial
+            cur.execute("DROP INDEX IF EXISTS idx_producto_embeddings_vector")
             cur.execute("DELETE FROM producto_embeddings")
             conn.commit()
             print(f"✓ Embeddings anteriores eliminados\n")
+        else:
+            preparar_upsert(cur)
+            conn.commit()
 
-        # Obtener productos sin embedding
-        cur.execute("""
-                    SELECT p.id, p.codigo, p.nombre, p.descripcion, p.categoria, p.proveedor
-                    FROM productos p
-                             LEFT JOIN producto_embeddings pe ON p.id = pe.producto_id
-                    WHERE pe.id IS NULL
-                      AND p.activo = true
-                    """)
-
-        productos = cur.fetchall()
-        print(f"Encontrados {len(productos)} productos sin embedding")
-
-        for producto in productos:
-            producto_dict = {
-                'id': producto[0],
-                'codigo': producto[1],
-                'nombre': producto[2],
-                'descripcion': producto[3],
-                'categoria': producto[4],
-                'proveedor': producto[5]
-            }
-
-            # Preparar texto
-            texto = preparar_texto_producto(producto_dict)
-            print(f"Generando embedding para: {producto_dict['codigo']} - {producto_dict['nombre']}")
-
-            # Generar embedding
-            embedding = generar_embedding(texto)
-
-            if embedding:
-                # Guardar en la base de datos
-                # Convertir el embedding a formato string para PostgreSQL
-                embedding_str = '[' + ','.join(map(str, embedding)) + ']'
-                cur.execute("""
-                            INSERT INTO producto_embeddings (producto_id, embedding, texto_embebido)
-                            VALUES (%s, %s, %s) ON CONFLICT (producto_id) 
-                    DO
-                            UPDATE SET
-                                embedding = EXCLUDED.embedding,
-                                texto_embebido = EXCLUDED.texto_embebido,
-                                fecha_generacion = CURRENT_TIMESTAMP
-                            """, (producto_dict['id'], embedding_str, texto))
-
-                conn.commit()
-                print(f"✓ Embedding guardado para producto {producto_dict['id']}")
-            else:
-                print(f"✗ Error generando embedding para producto {producto_dict['id']}")
-
-            # Pequeña pausa para no sobrecargar
-            time.sleep(0.5)
-
-        print(f"\n✓ Proceso completado. {len(productos)} embeddings generados.")
+        semaforo = asyncio.Semaphore(MAX_CONCURRENCIA)
+        loop = asyncio.get_running_loop()
+        en_vuelo = set()
+        escrituras = []
+        leidos = 0
+
+        # Un hilo reclama lotes de productos y otro escribe en la base de datos, así
+        # las esperas de PostgreSQL no bloquean el bucle que atiende a Ollama.
+        # Al salir del bloque se espera a que terminen las escrituras pendientes
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='lector') as lector, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='escritor') as escritor:
+
+            async def guardar_y_liberar(resultado):
+                """Guardar un lote y liberar sus locks (en el hilo lector, dueño de la conexión)"""
+                try:
+                    return await loop.run_in_executor(escritor, guardar_lote, conn, cur, resultado, forzar)
+                finally:
+                    await loop.run_in_executor(lector, liberar_lote, conn_lectura, resultado[0])
+
+            ultimo_id = 0
+            while True:
+                lote, ultimo_id = await loop.run_in_executor(lector, reclamar_lote, conn_lectura, ultimo_id)
+                if ultimo_id is None:
+                    break
+                if not lote:
+                    # Todos los candidatos los procesa otro generador
+                    continue
+
+                # Preparar textos del lote
+                textos = preparar_textos_lote(lote)
+                descripcion = f"{leidos + 1}-{leidos + len(lote)}"
+                leidos += len(lote)
+                en_vuelo.add(asyncio.ensure_future(embeber_lote(semaforo, lote, textos, descripcion)))
+
+                # No leer más productos de los que se pueden procesar a la vez
+                if len(en_vuelo) >= MAX_CONCURRENCIA * 2:
+                    terminadas, en_vuelo = await asyncio.wait(en_vuelo, return_when=asyncio.FIRST_COMPLETED)
+                    for tarea in terminadas:
+                        escrituras.append(asyncio.ensure_future(guardar_y_liberar(tarea.result())))
+
+            print(f"Encontrados {leidos} productos sin embedding o con texto modificado")
+
+            for tarea in asyncio.as_completed(en_vuelo):
+                resultado = await tarea
+                escrituras.append(asyncio.ensure_future(guardar_y_liberar(resultado)))
+
+            generados = sum(await asyncio.gather(*escrituras))
+
+        print(f"\n✓ Proceso completado. {generados} embeddings generados.")
 
     except Exception as e:
         print(f"Error: {e}")
         conn.rollback()
+        conn_lectura.rollback()
     finally:
         cur.close()
-        conn.close()
-
+        try:
+            # Liberar los productos que sigan reclamados si la carga se interrumpió
+            with conn_lectura.cursor() as cur_lectura:
+                cur_lectura.execute("SELECT pg_advisory_unlock_all()")
+            conn_lectura.commit()
+            # Recrear siempre el índice, aunque la carga haya fallado
+            if forzar:
+                crear_indice_vector(conn)
+        finally:
+            liberar_db(conn)
+            liberar_db(conn_lectura)
+
+
+def buscar_por_vector(query_embedding, limite=5):
+    """Buscar los productos más similares a un embedding de consulta ya calculado
 
-def buscar_productos_semanticamente(consulta, limite=5):
-    """Buscar productos usando búsqueda semántica"""
+    Args:
+        query_embedding (numpy.ndarray): Embedding normalizado de la consulta
+        limite (int): Número máximo de resultados
+    """
     conn = conectar_db()
     cur = conn.cursor()
 
     try:
-        # Generar embedding de la consulta
-        print(f"Buscando: '{consulta}'")
-        query_embedding = generar_embedding(consulta)
-
-        if not query_embedding:
-            print("Error generando embedding de búsqueda")
-            return []
-
         # Buscar productos similares
-        # Convertir el embedding a formato string para PostgreSQL
-        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-
-        # NOTA: Hay un bug con ORDER BY + LIMIT en psycopg2 con pgvector
-        # Solución: traer todos y limitar en Python
-        cur.execute("""
+        # ORDER BY + LIMIT en el servidor para que el índice HNSW devuelva solo el top-k.
+        cur.execute(f"""
                     SELECT 
                         p.id,
                         p.codigo,
                         p.nombre,
                         p.descripcion,
-                        pe.embedding <=> %s::vector(384) as distancia
+                        pe.embedding <#> %s::halfvec({EMBED_DIM}) as distancia
                     FROM producto_embeddings pe
                     JOIN productos p ON pe.producto_id = p.id
                     WHERE p.activo = true
-                    ORDER BY 5
-                    """, (embedding_str,))
+                    ORDER BY pe.embedding <#> %s::halfvec({EMBED_DIM})
+                    LIMIT %s
+                    """, (query_embedding, query_embedding, limite))
 
-        # Obtener todos los resultados y limitar en Python
-        todos_resultados = cur.fetchall()
-        # Calcular similitud (1 - distancia) y limitar
-        resultados = [(r[0], r[1], r[2], r[3], 1 - r[4]) for r in todos_resultados[:limite]]
+        # <#> devuelve el producto escalar negativo: entre vectores unitarios es -coseno
+        resultados = [(r[0], r[1], r[2], r[3], -r[4]) for r in cur.fetchall()]
 
         print(f"\nResultados encontrados: {len(resultados)}")
         print("-" * 80)
@@ -194,7 +578,20 @@ def buscar_productos_semanticamente(consulta, limite=5):
         return []
     finally:
         cur.close()
-        conn.close()
+        liberar_db(conn)
+
+
+def buscar_productos_semanticamente(consulta, limite=5):
+    """Buscar productos usando búsqueda semántica"""
+    # Generar embedding de la consulta
+    print(f"Buscando: '{consulta}'")
+    query_embedding = generar_embedding(consulta)
+
+    if query_embedding is None:
+        print("Error generando embedding de búsqueda")
+        return []
+
+    return buscar_por_vector(query_embedding, limite)
 
 
 if __name__ == "__main__":
@@ -210,7 +607,7 @@ if __name__ == "__main__":
 
     # Generar embeddings para productos existentes
     print("1. Generando embeddings para productos...")
-    generar_embeddings_productos(forzar=forzar)
+    asyncio.run(generar_embeddings_productos(forzar=forzar))
 
     # Ejemplos de búsqueda semántica
     print("\n2. Probando búsqueda semántica...\n")
@@ -223,6 +620,14 @@ if __name__ == "__main__":
         "silla oficina ergonómica"
     ]
 
-    for consulta in consultas_ejemplo:
-        buscar_productos_semanticamente(consulta, limite=3)
+    # Embeber todas las consultas en una sola petición a Ollama
+    embeddings_consultas = generar_embeddings_batch(consultas_ejemplo)
+
+    if embeddings_consultas is None:
+        print("Error generando embeddings de búsqueda")
+        sys.exit(1)
+
+    for consulta, embedding in zip(consultas_ejemplo, embeddings_consultas):
+        print(f"Buscando: '{consulta}'")
+        buscar_por_vector(normalizar(embedding), limite=3)
         print("=" * 80)
\ No newline at end of file
@@ -0,0 +1,22 @@
+# gunicorn.conf.py
+"""
+Configuración de gunicorn para la API (make api)
+
+Los endpoints pasan casi todo el tiempo esperando a Ollama y a PostgreSQL:
+con workers gevent cada proceso atiende muchas peticiones a la vez en lugar
+de bloquear un hilo por petición.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('API_BIND', '0.0.0.0:5100')
+worker_class = 'gevent'
+workers = int(os.getenv('API_WORKERS', multiprocessing.cpu_count()))
+worker_connections = int(os.getenv('API_WORKER_CONNECTIONS', 1000))
+
+
+def post_fork(server, worker):
+    """Hacer que psycopg2 ceda el control a gevent mientras espera a PostgreSQL"""
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -22,27 +22,34 @@ CREATE TABLE productos (
 CREATE TABLE producto_embeddings (
     id SERIAL PRIMARY KEY,
     producto_id INTEGER REFERENCES productos(id) ON DELETE CASCADE,
-    embedding vector(384),  -- all-minilm genera vectores de 384 dimensiones
+    embedding halfvec(384),  -- all-minilm genera vectores de 384 dimensiones (fp16: 2 bytes/dim)
     texto_embebido TEXT,     -- Texto que se usó para generar el embedding
+    texto_sha BYTEA,         -- SHA-256 de modelo y texto, para no regenerar si no cambia
     fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(producto_id)
 );
 
--- Índice para búsqueda vectorial rápida (IVFFlat)
+-- Índice para búsqueda vectorial rápida (HNSW)
+-- A diferencia de IVFFlat no necesita datos previos para entrenar sus listas.
+-- Los embeddings se guardan normalizados: el producto escalar es la similitud
+-- coseno y no hace falta calcular normas por fila
 CREATE INDEX idx_producto_embeddings_vector
 ON producto_embeddings
-USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+USING hnsw (embedding halfvec_ip_ops);
 
--- Índice para búsquedas por producto
+-- Índice para búsquedas por producto. Incluye fecha_generacion para que
+-- obtener_producto lo resuelva con un index-only scan sin leer el vector
 CREATE INDEX idx_producto_embeddings_producto_id
-ON producto_embeddings(producto_id);
+ON producto_embeddings(producto_id) INCLUDE (fecha_generacion);
 
 -- Índices para optimizar búsquedas en productos
 CREATE INDEX idx_productos_codigo ON productos(codigo);
 CREATE INDEX idx_productos_categoria ON productos(categoria);
 CREATE INDEX idx_productos_activo ON productos(activo);
 
+-- Listado paginado de productos activos ordenado por nombre
+CREATE INDEX idx_productos_activos_nombre ON productos(nombre) WHERE activo = true;
+
 -- Función para actualizar timestamp
 CREATE OR REPLACE FUNCTION actualizar_timestamp()
 RETURNS TRIGGER AS $$
@@ -58,9 +65,36 @@ CREATE TRIGGER trigger_actualizar_productos
     FOR EACH ROW
     EXECUTE FUNCTION actualizar_timestamp();
 
+-- Contador de cambios del catálogo (índice local de la API). Cada escritura lo
+-- incrementa en su propia transacción: solo cambia al confirmarse los datos
+CREATE TABLE catalogo_version (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalogo_version DEFAULT VALUES;
+
+CREATE OR REPLACE FUNCTION incrementar_version_catalogo()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE catalogo_version SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_version_productos
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON productos
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION incrementar_version_catalogo();
+
+CREATE TRIGGER trigger_version_embeddings
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON producto_embeddings
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION incrementar_version_catalogo();
+
 -- Función para búsqueda semántica de productos
 CREATE OR REPLACE FUNCTION buscar_productos_similares(
-    query_embedding vector(384),
+    query_embedding halfvec(384),
     limite INTEGER DEFAULT 10
 )
 RETURNS TABLE (
@@ -77,15 +111,31 @@ BEGIN
         p.codigo,
         p.nombre,
         p.descripcion,
-        1 - (pe.embedding <=> query_embedding) as similitud
+        -(pe.embedding <#> query_embedding) as similitud
     FROM producto_embeddings pe
     JOIN productos p ON pe.producto_id = p.id
     WHERE p.activo = true
-    ORDER BY pe.embedding <=> query_embedding
+    ORDER BY pe.embedding <#> query_embedding  -- Producto escalar negativo sobre vectores normalizados (usa el índice)
     LIMIT limite;
 END;
 $$ LANGUAGE plpgsql;
 
+-- Registro de migraciones (make db-migrate). Una base nueva ya tiene el esquema final
+CREATE TABLE schema_migrations (
+    nombre VARCHAR(255) PRIMARY KEY,
+    fecha_aplicacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_migrations (nombre) VALUES
+('001_indice_hnsw.sql'),
+('002_indice_l2.sql'),
+('003_halfvec.sql'),
+('004_texto_sha.sql'),
+('005_indice_producto_include.sql'),
+('006_indice_activos_nombre.sql'),
+('007_indice_producto_escalar.sql'),
+('008_version_catalogo.sql');
+
 -- Insertar algunos datos de ejemplo
 INSERT INTO productos (codigo, nombre, descripcion, categoria, precio, stock, ubicacion, proveedor) VALUES
 ('PROD-001', 'Laptop Dell XPS 13', 'Laptop ultradelgada 13 pulgadas, Intel i7, 16GB RAM', 'Electrónica', 1299.99, 15, 'Almacén A-1', 'Dell Inc'),
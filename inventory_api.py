@@ -5,14 +5,34 @@ Implementa buenas prácticas de precisión de embeddings
 """
 
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from werkzeug.http import http_date
+import orjson
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from pgvector.psycopg2 import register_vector
 import ollama
+import httpx
+import numpy as np
+import redis
 import os
+import socket
 from dotenv import load_dotenv
 import logging
-from functools import wraps
+from functools import wraps, lru_cache
+from typing import List, Union
+from contextlib import contextmanager
+import atexit
+import threading
+import time
+import weakref
+from datetime import date
+from decimal import Decimal
+
+from texto_producto import preparar_texto
+from cache_embeddings import normalizar, hash_texto, leer_cache, guardar_cache
 
 # Configurar logging
 logging.basicConfig(
@@ -24,7 +44,40 @@ logger = logging.getLogger(__name__)
 # Cargar variables de entorno
 load_dotenv()
 
+def _json_default(obj):
+    """Serializar los tipos que orjson no convierte igual que Flask"""
+    if isinstance(obj, date):
+        # Mismo formato de fecha que el serializador por defecto de Flask
+        return http_date(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+
+class OrjsonProvider(JSONProvider):
+    """Serializador JSON de Flask basado en orjson (escribe bytes directamente)"""
+
+    opciones = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=self.opciones).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        opciones = self.opciones
+        if self._app.debug:
+            opciones |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=_json_default, option=opciones),
+            mimetype='application/json'
+        )
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)  # Permitir CORS para desarrollo
 
 # Configuración desde variables de entorno
@@ -39,13 +92,216 @@ DB_CONFIG = {
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'all-minilm')
 
+# Caché de embeddings en Redis (opcional), compartida entre workers y con
+# generate_embeddings.py: sin REDIS_URL solo se usa la caché en memoria
+REDIS_URL = os.getenv('REDIS_URL')
+CACHE_TTL = int(os.getenv('CACHE_TTL', 7 * 86400))
+
+# Transporte HTTP compartido por todas las peticiones: mantiene abiertas las
+# conexiones con Ollama (keep-alive) y desactiva Nagle (TCP_NODELAY) porque las
+# peticiones de embedding son pequeñas
+ollama_transport = httpx.HTTPTransport(
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=100),
+    socket_options=[(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
+)
+
 # Cliente Ollama configurado
-ollama_client = ollama.Client(host=OLLAMA_HOST)
+ollama_client = ollama.Client(host=OLLAMA_HOST, transport=ollama_transport, timeout=30)
+
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Dimensión usada si Ollama no responde al arrancar (all-minilm)
+DIMENSION_POR_DEFECTO = 384
+
+# Segundos durante los que se reutiliza la lista de modelos de Ollama en /health
+MODELOS_TTL = 30
+
+
+def obtener_dimension_modelo():
+    """
+    Obtener la dimensión de los embeddings del modelo configurado
+
+    Se consulta una sola vez al arrancar con un embedding de prueba.
+
+    Returns:
+        int: Número de dimensiones de los embeddings
+    """
+    try:
+        response = ollama_client.embed(model=OLLAMA_MODEL, input="x")
+        return len(response['embeddings'][0])
+    except Exception as e:
+        logger.warning("No se pudo consultar la dimensión de %s, usando %s: %s", OLLAMA_MODEL, DIMENSION_POR_DEFECTO, e)
+        return DIMENSION_POR_DEFECTO
+
+
+MODEL_DIMS = obtener_dimension_modelo()
+
+# Última lista de modelos instalados en Ollama y momento de la consulta
+_modelos_cache = {'nombres': None, 'ultima_consulta': 0.0}
+
+
+def listar_modelos():
+    """
+    Obtener los nombres de los modelos instalados en Ollama
+
+    La lista se reutiliza durante MODELOS_TTL segundos para que los sondeos
+    frecuentes de /health no consulten a Ollama en cada petición.
+
+    Returns:
+        list: Nombres de los modelos instalados
+    """
+    ahora = time.monotonic()
+    if _modelos_cache['nombres'] is None or ahora - _modelos_cache['ultima_consulta'] > MODELOS_TTL:
+        models = ollama_client.list()
+        _modelos_cache['nombres'] = [m.get('name', m.get('model', '')) for m in models.get('models', [])]
+        _modelos_cache['ultima_consulta'] = ahora
+    return _modelos_cache['nombres']
+
+# Contadores de la caché de embeddings (expuestos en /health)
+cache_stats = {'redis_hits': 0, 'misses': 0}
+
+# Caché semántica de búsquedas (opcional, desactivada por defecto): consultas
+# casi idénticas ("laptop Dell XPS" y "Dell XPS laptop") reutilizan la respuesta
+# anterior. Es local a cada proceso y solo se vacía con las escrituras del
+# propio proceso: con varios workers, los cambios hechos en otro pueden tardar
+# hasta SEMANTIC_CACHE_TTL segundos en verse. Activarla solo si eso es aceptable
+SEMANTIC_CACHE_SIZE = max(int(os.getenv('SEMANTIC_CACHE_SIZE', 0)), 0)
+SEMANTIC_CACHE_UMBRAL = float(os.getenv('SEMANTIC_CACHE_UMBRAL', 0.97))
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', 60))
+
+_qcache_lock = threading.Lock()
+_qcache_vecs = None        # Matriz (SEMANTIC_CACHE_SIZE, dim) de consultas normalizadas
+_qcache_entradas = []      # (clave, respuesta) de cada fila ocupada de la matriz
+_qcache_uso = np.zeros(SEMANTIC_CACHE_SIZE)      # Último uso de cada fila (LRU)
+_qcache_creacion = np.zeros(SEMANTIC_CACHE_SIZE)  # Momento de creación (TTL)
+
+
+# Pool de conexiones compartido por todas las peticiones: evita abrir una
+# conexión nueva (TCP + autenticación) en cada request. Cada worker de gunicorn
+# tiene su propio pool: DB_CONEXIONES_API se reparte entre API_WORKERS (el mismo
+# valor que usa gunicorn.conf.py) para no superar max_connections de PostgreSQL
+API_WORKERS = int(os.getenv('API_WORKERS', os.cpu_count() or 1))
+DB_CONEXIONES_API = int(os.getenv('DB_CONEXIONES_API', 80))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', max(DB_CONEXIONES_API // API_WORKERS, 1)))
+DB_POOL_ESPERA = float(os.getenv('DB_POOL_ESPERA', 30))
+POOL = ThreadedConnectionPool(minconn=min(2, DB_POOL_MAX), maxconn=DB_POOL_MAX, **DB_CONFIG)
+atexit.register(POOL.closeall)
+
+# Con workers gevent hay muchas más peticiones simultáneas que conexiones y
+# POOL.getconn() falla con PoolError cuando se agotan. Las peticiones esperan
+# turno en este semáforo (gevent lo parchea para que ceda el control)
+_pool_semaforo = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+# Sentencias preparadas una vez por conexión para las inserciones frecuentes:
+# PostgreSQL no vuelve a analizar ni planificar el SQL en cada petición
+SENTENCIAS_PREPARADAS = [
+    """
+    PREPARE ins_prod(varchar, varchar, text, varchar, numeric, integer, varchar, varchar) AS
+    INSERT INTO productos
+    (codigo, nombre, descripcion, categoria, precio, stock, ubicacion, proveedor)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+    RETURNING id
+    """,
+    f"""
+    PREPARE ins_emb(integer, halfvec({MODEL_DIMS}), text, bytea) AS
+    INSERT INTO producto_embeddings (producto_id, embedding, texto_embebido, texto_sha)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (producto_id)
+    DO UPDATE SET
+        embedding = EXCLUDED.embedding,
+        texto_embebido = EXCLUDED.texto_embebido,
+        texto_sha = EXCLUDED.texto_sha,
+        fecha_generacion = CURRENT_TIMESTAMP
+    """
+]
+
+# Máximo de resultados por búsqueda semántica
+LIMITE_MAXIMO = 1000
+
+# Máximo de productos por petición de creación en lote
+BULK_MAXIMO = 500
+
+# Consultas de lectura frecuentes, construidas una sola vez al importar el módulo.
+# Búsqueda: ORDER BY + LIMIT en el servidor con el mismo operador que el índice
+# HNSW (halfvec_ip_ops), así el índice devuelve solo los `limite` más cercanos
+SEARCH_SQL = f"""
+    SELECT 
+        p.id,
+        p.codigo,
+        p.nombre,
+        p.descripcion,
+        p.categoria,
+        p.precio,
+        p.stock,
+        pe.embedding <#> %s::halfvec({MODEL_DIMS}) as distancia
+    FROM producto_embeddings pe
+    JOIN productos p ON pe.producto_id = p.id
+    WHERE p.activo = true
+    ORDER BY pe.embedding <#> %s::halfvec({MODEL_DIMS})
+    LIMIT %s
+"""
+
+SEARCH_COUNT_SQL = """
+    SELECT COUNT(*)
+    FROM producto_embeddings pe
+    JOIN productos p ON pe.producto_id = p.id
+    WHERE p.activo = true
+"""
+
+# Listado paginado: productos y total en una sola consulta, con y sin filtro
+_LIST_SQL = """
+    SELECT id, codigo, nombre, descripcion, categoria, 
+           precio, stock, ubicacion, proveedor,
+           COUNT(*) OVER () as total
+    FROM productos
+    {where}
+    ORDER BY nombre
+    LIMIT %s OFFSET %s
+"""
+LIST_SQL_ALL = _LIST_SQL.format(where="WHERE activo = true")
+LIST_SQL_CAT = _LIST_SQL.format(where="WHERE activo = true AND categoria = %s")
+
+LIST_COUNT_SQL_ALL = "SELECT COUNT(*) as total FROM productos WHERE activo = true"
+LIST_COUNT_SQL_CAT = "SELECT COUNT(*) as total FROM productos WHERE activo = true AND categoria = %s"
+
+# Conexiones del pool que ya tienen las sentencias preparadas
+_conexiones_preparadas = weakref.WeakSet()
+
 
+def preparar_conexion(conn):
+    """Preparar una conexión nueva del pool
 
-def get_db():
-    """Obtener conexión a la base de datos"""
-    return psycopg2.connect(**DB_CONFIG)
+    Registra los tipos de pgvector (los arrays de numpy se pasan directamente
+    como parámetros vector/halfvec) y prepara las sentencias de inserción.
+    """
+    register_vector(conn)
+    with conn.cursor() as cur:
+        for sentencia in SENTENCIAS_PREPARADAS:
+            cur.execute(sentencia)
+    conn.commit()
+    _conexiones_preparadas.add(conn)
+
+
+@contextmanager
+def get_conn():
+    """Obtener una conexión del pool y devolverla al terminar
+
+    Si todas las conexiones están en uso espera hasta DB_POOL_ESPERA segundos.
+    Si queda una transacción abierta, el pool la deshace al recibir la conexión.
+    """
+    if not _pool_semaforo.acquire(timeout=DB_POOL_ESPERA):
+        raise PoolError("No hay conexiones libres en el pool")
+    try:
+        conn = POOL.getconn()
+        try:
+            if conn not in _conexiones_preparadas:
+                preparar_conexion(conn)
+            yield conn
+        finally:
+            POOL.putconn(conn)
+    finally:
+        _pool_semaforo.release()
 
 
 def handle_errors(f):
@@ -55,14 +311,14 @@ def handle_errors(f):
         try:
             return f(*args, **kwargs)
         except psycopg2.Error as e:
-            logger.error(f"Error de base de datos: {e}")
+            logger.error("Error de base de datos: %s", e)
             return jsonify({
                 'success': False,
                 'error': 'Error de base de datos',
                 'detail': str(e)
             }), 500
         except Exception as e:
-            logger.error(f"Error inesperado: {e}")
+            logger.error("Error inesperado: %s", e)
             return jsonify({
                 'success': False,
                 'error': 'Error interno del servidor',
@@ -86,44 +342,372 @@ def preparar_texto_embedding(producto):
     Returns:
         str: Texto optimizado para generar embedding
     """
-    nombre = producto.get('nombre', '')
-    categoria = producto.get('categoria', '')
-    descripcion = producto.get('descripcion', '')
-    codigo = producto.get('codigo', '')
-    proveedor = producto.get('proveedor', '')
-
-    # Repetir información clave para aumentar el peso semántico
-    texto_parts = [
-        f"{nombre}",  # Nombre al inicio (mayor peso)
-        f"Producto: {nombre}",  # Repetir nombre con contexto
-        f"Categoría: {categoria}" if categoria else "",
-        f"Tipo: {categoria}" if categoria else "",  # Repetir categoría
-        f"{descripcion}" if descripcion else "",
-        f"Código: {codigo}",
-        f"Proveedor: {proveedor}" if proveedor else ""
-    ]
+    # Misma construcción que generate_embeddings.py (y su versión SQL para el
+    # hash del texto), compilable con mypyc: sin lista intermedia ni filter/join
+    return preparar_texto(
+        producto.get('codigo', ''),
+        producto.get('nombre', ''),
+        producto.get('descripcion'),
+        producto.get('categoria'),
+        producto.get('proveedor')
+    )
+
+
+@lru_cache(maxsize=4096)
+def _embed_cached(model, texto):
+    """
+    Caché en memoria delante de Redis y Ollama
+
+    Args:
+        model (str): Modelo de embeddings (forma parte de la clave de caché)
+        texto (str): Texto para generar el embedding
+
+    Returns:
+        tuple: Embedding como tupla de floats (inmutable, se comparte entre peticiones)
+    """
+    embedding = leer_cache(redis_client, model, [texto])[0]
+    if embedding is not None:
+        cache_stats['redis_hits'] += 1
+        return tuple(embedding.tolist())
+
+    cache_stats['misses'] += 1
+    # Si falla, la excepción se propaga y lru_cache no guarda el resultado
+    embedding = ollama_client.embed(model=model, input=texto)['embeddings'][0]
+    guardar_cache(redis_client, CACHE_TTL, model, [texto], [embedding])
 
-    return " ".join(filter(None, texto_parts))
+    return tuple(embedding)
 
 
-def generar_embedding(texto):
+def _embed_lote(textos):
+    """
+    Generar los embeddings de varios textos con una sola llamada a Ollama
+
+    Solo se envían a Ollama los textos que no están en la caché Redis.
+
+    Args:
+        textos (list): Textos para generar los embeddings
+
+    Returns:
+        list: Embedding de cada texto, en el mismo orden
+    """
+    embeddings = leer_cache(redis_client, OLLAMA_MODEL, textos)
+    pendientes = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    cache_stats['redis_hits'] += len(textos) - len(pendientes)
+    cache_stats['misses'] += len(pendientes)
+    if not pendientes:
+        return embeddings
+
+    textos_pendientes = [textos[i] for i in pendientes]
+    response = ollama_client.embed(model=OLLAMA_MODEL, input=textos_pendientes)
+    for i, embedding in zip(pendientes, response['embeddings']):
+        embeddings[i] = embedding
+    guardar_cache(redis_client, CACHE_TTL, OLLAMA_MODEL, textos_pendientes, response['embeddings'])
+
+    return embeddings
+
+
+def generar_embedding(texto: Union[str, List[str]]):
     """
     Generar embedding usando Ollama con manejo de errores
 
+    Las consultas repetidas se sirven desde la caché en memoria o desde Redis
+    sin llamar a Ollama. Con una lista de textos se hace una única llamada
+    por lotes a /api/embed.
+
     Args:
-        texto (str): Texto para generar el embedding
+        texto (str | list): Texto, o lista de textos, para generar el embedding
 
     Returns:
-        list: Embedding como lista de floats, o None si hay error
+        list: Embedding como lista de floats (una lista de embeddings si se
+            pasó una lista de textos), o None si hay error
     """
     try:
-        response = ollama_client.embed(model=OLLAMA_MODEL, input=texto)
-        return response['embeddings'][0]
+        if isinstance(texto, list):
+            return _embed_lote(texto)
+        return list(_embed_cached(OLLAMA_MODEL, texto))
     except Exception as e:
-        logger.error(f"Error generando embedding: {e}")
+        logger.error("Error generando embedding: %s", e)
         return None
 
 
+def buscar_cache_semantica(query_vec, clave):
+    """
+    Buscar una respuesta guardada para una consulta casi idéntica
+
+    Args:
+        query_vec (numpy.ndarray): Embedding normalizado de la consulta
+        clave (tuple): Parámetros que cambian la respuesta (limite, total)
+
+    Returns:
+        dict: Respuesta guardada, o None si no hay ninguna por encima del umbral
+    """
+    if SEMANTIC_CACHE_SIZE == 0:
+        return None
+    with _qcache_lock:
+        n = len(_qcache_entradas)
+        if n == 0:
+            return None
+
+        ahora = time.monotonic()
+        sims = _qcache_vecs[:n] @ query_vec
+        sims[_qcache_creacion[:n] < ahora - SEMANTIC_CACHE_TTL] = -1
+        candidatos = np.flatnonzero(sims > SEMANTIC_CACHE_UMBRAL)
+        for i in candidatos[np.argsort(-sims[candidatos])]:
+            clave_guardada, respuesta = _qcache_entradas[i]
+            if clave_guardada == clave:
+                _qcache_uso[i] = ahora
+                return respuesta
+    return None
+
+
+def guardar_cache_semantica(query_vec, clave, respuesta):
+    """
+    Guardar la respuesta de una búsqueda en la caché semántica
+
+    Si la caché está llena se reemplaza la entrada usada hace más tiempo.
+
+    Args:
+        query_vec (numpy.ndarray): Embedding normalizado de la consulta
+        clave (tuple): Parámetros que cambian la respuesta (limite, total)
+        respuesta (dict): Respuesta a reutilizar
+    """
+    global _qcache_vecs
+    if SEMANTIC_CACHE_SIZE == 0:
+        return
+    with _qcache_lock:
+        if _qcache_vecs is None:
+            _qcache_vecs = np.zeros((SEMANTIC_CACHE_SIZE, len(query_vec)), dtype=np.float32)
+
+        if len(_qcache_entradas) < SEMANTIC_CACHE_SIZE:
+            i = len(_qcache_entradas)
+            _qcache_entradas.append((clave, respuesta))
+        else:
+            i = int(np.argmin(_qcache_uso))
+            _qcache_entradas[i] = (clave, respuesta)
+
+        ahora = time.monotonic()
+        _qcache_vecs[i] = query_vec
+        _qcache_uso[i] = ahora
+        _qcache_creacion[i] = ahora
+
+
+def limpiar_cache_semantica():
+    """Vaciar la caché semántica tras modificar productos"""
+    with _qcache_lock:
+        _qcache_entradas.clear()
+
+
+# Índice local (opcional, desactivado por defecto): con catálogos pequeños cada
+# proceso guarda en memoria los embeddings de los productos activos (matriz
+# float32 contigua) y resuelve la búsqueda con un producto matriz-vector en
+# lugar de recorrer el índice HNSW. Cada INDICE_LOCAL_TTL segundos se compara
+# la versión del catálogo (tabla catalogo_version, que incrementan los triggers
+# de productos y producto_embeddings) con la del índice cargado y se recarga si
+# otro worker o generate_embeddings.py ha escrito. Si el catálogo supera
+# INDICE_LOCAL_MAX no se comprueba nada y la carga se reintenta cada
+# INDICE_LOCAL_REINTENTO segundos
+INDICE_LOCAL_MAX = int(os.getenv('INDICE_LOCAL_MAX', 0))
+INDICE_LOCAL_TTL = float(os.getenv('INDICE_LOCAL_TTL', 5))
+INDICE_LOCAL_REINTENTO = 600
+
+# Lectura por clave primaria de una única fila
+VERSION_CATALOGO_SQL = "SELECT version FROM catalogo_version"
+
+_indice_local_lock = threading.Lock()
+_indice_local = {
+    'matriz': None,
+    'productos': [],
+    'comprobado': None,         # Última carga o comprobación de versión
+    'version': None,            # Versión del catálogo cargado
+    'demasiado_grande': False   # El catálogo supera INDICE_LOCAL_MAX
+}
+
+
+def _similitudes_numpy(matriz, query_vec):
+    """Similitud de la consulta con cada fila (un único SGEMV de BLAS)"""
+    return matriz @ query_vec
+
+
+try:
+    import numba
+
+    @numba.njit(fastmath=True, parallel=True, cache=True)
+    def _similitudes(matriz, query_vec):
+        """Similitud de la consulta con cada fila, compilada con Numba"""
+        n, dim = matriz.shape
+        sims = np.empty(n, dtype=np.float32)
+        for i in numba.prange(n):
+            acumulado = np.float32(0.0)
+            for j in range(dim):
+                acumulado += matriz[i, j] * query_vec[j]
+            sims[i] = acumulado
+        return sims
+except ImportError:
+    # Numba es opcional: sin él se usa numpy
+    _similitudes = _similitudes_numpy
+
+
+def version_catalogo():
+    """
+    Leer la versión actual del catálogo
+
+    Returns:
+        int: Contador de escrituras confirmadas en productos y producto_embeddings
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(VERSION_CATALOGO_SQL)
+        return cur.fetchone()[0]
+
+
+def cargar_indice_local():
+    """
+    Cargar en memoria los embeddings de los productos activos
+
+    Si el catálogo supera INDICE_LOCAL_MAX productos el índice queda
+    desactivado y las búsquedas van a PostgreSQL hasta el siguiente reintento.
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        # La versión se lee antes que los datos: si cambia entre ambas lecturas
+        # la siguiente comprobación vuelve a cargar el índice
+        cur.execute(VERSION_CATALOGO_SQL)
+        version = cur.fetchone()[0]
+        cur.execute("""
+            SELECT p.id, p.codigo, p.nombre, p.descripcion, p.categoria,
+                   p.precio, p.stock, pe.embedding::vector
+            FROM producto_embeddings pe
+            JOIN productos p ON pe.producto_id = p.id
+            WHERE p.activo = true
+            LIMIT %s
+        """, (INDICE_LOCAL_MAX + 1,))
+        filas = cur.fetchall()
+
+    demasiado_grande = len(filas) > INDICE_LOCAL_MAX
+    if not filas or demasiado_grande:
+        _indice_local['matriz'] = None
+        _indice_local['productos'] = []
+    else:
+        _indice_local['matriz'] = np.ascontiguousarray(
+            np.vstack([fila[7] for fila in filas]), dtype=np.float32
+        )
+        _indice_local['productos'] = [
+            {
+                'id': pid,
+                'codigo': codigo,
+                'nombre': nombre,
+                'descripcion': descripcion,
+                'categoria': categoria,
+                'precio': float(precio) if precio else None,
+                'stock': stock
+            }
+            for pid, codigo, nombre, descripcion, categoria, precio, stock, _ in filas
+        ]
+    _indice_local['comprobado'] = time.monotonic()
+    _indice_local['version'] = version
+    _indice_local['demasiado_grande'] = demasiado_grande
+    logger.info("Índice local cargado: %s productos", len(_indice_local['productos']))
+
+
+def invalidar_indice_local():
+    """Forzar la recarga del índice local tras modificar productos"""
+    with _indice_local_lock:
+        # Con el catálogo demasiado grande se espera al siguiente reintento
+        if not _indice_local['demasiado_grande']:
+            _indice_local['comprobado'] = None
+
+
+def buscar_indice_local(query_vec, limite):
+    """
+    Buscar los productos más similares en el índice local
+
+    Args:
+        query_vec (numpy.ndarray): Embedding normalizado de la consulta
+        limite (int): Número máximo de resultados
+
+    Returns:
+        tuple: (resultados, total de productos), o None si el índice local
+            está desactivado (catálogo demasiado grande o vacío)
+    """
+    if INDICE_LOCAL_MAX <= 0:
+        return None
+
+    with _indice_local_lock:
+        comprobado = _indice_local['comprobado']
+        transcurrido = time.monotonic() - comprobado if comprobado is not None else None
+        if transcurrido is None:
+            cargar_indice_local()
+        elif _indice_local['demasiado_grande']:
+            if transcurrido > INDICE_LOCAL_REINTENTO:
+                cargar_indice_local()
+        elif transcurrido > INDICE_LOCAL_TTL:
+            if version_catalogo() != _indice_local['version']:
+                cargar_indice_local()
+            else:
+                _indice_local['comprobado'] = time.monotonic()
+        matriz = _indice_local['matriz']
+        productos = _indice_local['productos']
+
+    if matriz is None:
+        return None
+
+    sims = _similitudes(matriz, query_vec)
+    if limite < len(sims):
+        indices = np.argpartition(-sims, limite)[:limite]
+    else:
+        indices = np.arange(len(sims))
+    indices = indices[np.argsort(-sims[indices])]
+
+    resultados = [
+        {**productos[i], 'similitud': float(sims[i])}
+        for i in indices
+    ]
+    return resultados, len(productos)
+
+
+def buscar_en_db(query_vec, limite, con_total):
+    """
+    Buscar los productos más similares en PostgreSQL
+
+    Args:
+        query_vec (numpy.ndarray): Embedding normalizado de la consulta
+        limite (int): Número máximo de resultados
+        con_total (bool): Si se debe contar el total de productos con embedding
+
+    Returns:
+        tuple: (resultados, total de productos o None si no se pidió)
+    """
+    # Cursor de tuplas: cada fila se convierte una sola vez en el dict de respuesta
+    with get_conn() as conn, conn.cursor() as cur:
+        if limite > 40:
+            # El índice explora ef_search candidatos (40 por defecto): con límites
+            # mayores devolvería menos filas de las pedidas. pgvector admite hasta 1000
+            cur.execute("SET LOCAL hnsw.ef_search = %s", (min(limite, 1000),))
+
+        cur.execute(SEARCH_SQL, (query_vec, query_vec, limite))
+
+        resultados_formateados = [
+            {
+                'id': pid,
+                'codigo': codigo,
+                'nombre': nombre,
+                'descripcion': descripcion,
+                'categoria': categoria,
+                'precio': float(precio) if precio else None,
+                'stock': stock,
+                # <#> devuelve el producto escalar negativo: entre vectores unitarios es -coseno
+                'similitud': float(-distancia)
+            }
+            for pid, codigo, nombre, descripcion, categoria, precio, stock, distancia in cur
+        ]
+
+        # El total solo se calcula si el cliente lo pide
+        total_disponible = None
+        if con_total:
+            cur.execute(SEARCH_COUNT_SQL)
+            total_disponible = cur.fetchone()[0]
+
+    return resultados_formateados, total_disponible
+
+
 @app.route('/api/productos/buscar', methods=['POST'])
 @handle_errors
 def buscar_productos():
@@ -133,13 +717,15 @@ def buscar_productos():
     Request JSON:
         {
             "consulta": "laptop Dell XPS",  # Usar términos específicos (marcas, modelos)
-            "limite": 10                    # Opcional, default 10
+            "limite": 10,                   # Opcional, default 10
+            "total": false                  # Opcional, incluir total_disponible
         }
 
     Response JSON:
         {
             "consulta": "laptop Dell XPS",
             "count": 3,
+            "total_disponible": 25,         # Solo si se pidió "total"
             "resultados": [...]
         }
 
@@ -164,7 +750,13 @@ def buscar_productos():
             'error': 'La consulta no puede estar vacía'
         }), 400
 
-    logger.info(f"Búsqueda semántica: '{consulta}' (límite: {limite})")
+    if isinstance(limite, bool) or not isinstance(limite, int) or not 1 <= limite <= LIMITE_MAXIMO:
+        return jsonify({
+            'success': False,
+            'error': f'El campo "limite" debe ser un entero entre 1 y {LIMITE_MAXIMO}'
+        }), 400
+
+    logger.info("Búsqueda semántica: '%s' (límite: %s)", consulta, limite)
 
     # Generar embedding de la consulta
     query_embedding = generar_embedding(consulta)
@@ -175,62 +767,37 @@ def buscar_productos():
             'error': 'Error generando embedding de búsqueda'
         }), 500
 
-    # Convertir embedding a formato PostgreSQL
-    embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-
-    # Buscar en DB
-    # NOTA: Aplicamos workaround del bug ORDER BY + LIMIT
-    # Obtenemos todos los resultados y limitamos en Python
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    cur.execute("""
-        SELECT 
-            p.id,
-            p.codigo,
-            p.nombre,
-            p.descripcion,
-            p.categoria,
-            p.precio,
-            p.stock,
-            pe.embedding <=> %s::vector(384) as distancia
-        FROM producto_embeddings pe
-        JOIN productos p ON pe.producto_id = p.id
-        WHERE p.activo = true
-        ORDER BY distancia
-    """, (embedding_str,))
-
-    # Obtener todos y limitar en Python (workaround bug ORDER BY + LIMIT)
-    todos_resultados = cur.fetchall()
-    resultados_limitados = todos_resultados[:limite]
-
-    cur.close()
-    conn.close()
-
-    # Formatear resultados
-    resultados_formateados = [
-        {
-            'id': r['id'],
-            'codigo': r['codigo'],
-            'nombre': r['nombre'],
-            'descripcion': r['descripcion'],
-            'categoria': r['categoria'],
-            'precio': float(r['precio']) if r['precio'] else None,
-            'stock': r['stock'],
-            'similitud': float(1 - r['distancia'])  # Convertir distancia a similitud
-        }
-        for r in resultados_limitados
-    ]
+    # Consultas casi idénticas reutilizan la respuesta sin ir a la base de datos
+    query_vec = normalizar(query_embedding)
+    con_total = bool(data.get('total'))
+    clave = (limite, con_total)
 
-    logger.info(f"Encontrados {len(resultados_formateados)} resultados")
+    respuesta = buscar_cache_semantica(query_vec, clave)
+    if respuesta is not None:
+        logger.info("Respuesta servida desde la caché semántica")
+        return jsonify({**respuesta, 'consulta': consulta})
 
-    return jsonify({
+    # Con el catálogo en memoria (índice local) no hace falta ir a la base de datos
+    resultado = buscar_indice_local(query_vec, limite)
+    if resultado is None:
+        resultado = buscar_en_db(query_vec, limite, con_total)
+    resultados_formateados, total = resultado
+    total_disponible = total if con_total else None
+
+    logger.info("Encontrados %s resultados", len(resultados_formateados))
+
+    respuesta = {
         'success': True,
         'consulta': consulta,
         'count': len(resultados_formateados),
-        'total_disponible': len(todos_resultados),
         'resultados': resultados_formateados
-    })
+    }
+    if total_disponible is not None:
+        respuesta['total_disponible'] = total_disponible
+
+    guardar_cache_semantica(query_vec, clave, respuesta)
+
+    return jsonify(respuesta)
 
 
 @app.route('/api/productos', methods=['GET'])
@@ -250,35 +817,29 @@ def listar_productos():
 
     offset = (page - 1) * per_page
 
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    # Elegir la consulta según el filtro opcional
+    if categoria:
+        list_sql, count_sql, params = LIST_SQL_CAT, LIST_COUNT_SQL_CAT, (categoria,)
+    else:
+        list_sql, count_sql, params = LIST_SQL_ALL, LIST_COUNT_SQL_ALL, ()
+
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Obtener productos paginados y el total en una sola consulta
+        cur.execute(list_sql, params + (per_page, offset))
 
-    # Construir query con filtro opcional
-    where_clause = "WHERE activo = true"
-    params = []
+        productos = [dict(p) for p in cur.fetchall()]
 
-    if categoria:
-        where_clause += " AND categoria = %s"
-        params.append(categoria)
-
-    # Contar total
-    cur.execute(f"SELECT COUNT(*) as total FROM productos {where_clause}", params)
-    total = cur.fetchone()['total']
-
-    # Obtener productos paginados
-    params.extend([per_page, offset])
-    cur.execute(f"""
-        SELECT id, codigo, nombre, descripcion, categoria, 
-               precio, stock, ubicacion, proveedor
-        FROM productos
-        {where_clause}
-        ORDER BY nombre
-        LIMIT %s OFFSET %s
-    """, params)
-
-    productos = cur.fetchall()
-    cur.close()
-    conn.close()
+        if productos:
+            total = productos[0]['total']
+        elif offset > 0:
+            # Página fuera de rango: no hay filas de las que leer el total
+            cur.execute(count_sql, params)
+            total = cur.fetchone()['total']
+        else:
+            total = 0
+
+    for p in productos:
+        del p['total']
 
     return jsonify({
         'success': True,
@@ -286,7 +847,7 @@ def listar_productos():
         'per_page': per_page,
         'total': total,
         'total_pages': (total + per_page - 1) // per_page,
-        'productos': [dict(p) for p in productos]
+        'productos': productos
     })
 
 
@@ -317,79 +878,186 @@ def crear_producto():
             'error': 'Faltan campos requeridos: codigo, nombre'
         }), 400
 
-    conn = get_db()
-    cur = conn.cursor()
+    # Generar texto y embedding antes de tomar una conexión del pool, para no
+    # retenerla mientras se espera a Ollama
+    texto = preparar_texto_embedding(data)
+    logger.info("Texto para embedding: %.100s...", texto)
+    embedding = generar_embedding(texto)
 
-    try:
-        # Insertar producto
-        cur.execute("""
-            INSERT INTO productos
-            (codigo, nombre, descripcion, categoria, precio, stock, ubicacion, proveedor)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) 
-            RETURNING id
-        """, (
-            data['codigo'],
-            data['nombre'],
-            data.get('descripcion'),
-            data.get('categoria'),
-            data.get('precio'),
-            data.get('stock', 0),
-            data.get('ubicacion'),
-            data.get('proveedor')
-        ))
-
-        producto_id = cur.fetchone()[0]
-
-        logger.info(f"Producto creado: {data['codigo']} (ID: {producto_id})")
-
-        # Generar texto optimizado para embedding
-        texto = preparar_texto_embedding(data)
-        logger.info(f"Texto para embedding: {texto[:100]}...")
-
-        # Generar embedding
-        embedding = generar_embedding(texto)
-
-        if not embedding:
-            # Rollback si falla el embedding
+    if not embedding:
+        return jsonify({
+            'success': False,
+            'error': 'Error generando embedding para el producto'
+        }), 500
+
+    with get_conn() as conn, conn.cursor() as cur:
+        try:
+            # Insertar producto
+            cur.execute("EXECUTE ins_prod(%s, %s, %s, %s, %s, %s, %s, %s)", (
+                data['codigo'],
+                data['nombre'],
+                data.get('descripcion'),
+                data.get('categoria'),
+                data.get('precio'),
+                data.get('stock', 0),
+                data.get('ubicacion'),
+                data.get('proveedor')
+            ))
+
+            producto_id = cur.fetchone()[0]
+
+            logger.info("Producto creado: %s (ID: %s)", data['codigo'], producto_id)
+
+            # Guardar embedding (pgvector adapta el array de numpy)
+            cur.execute(
+                "EXECUTE ins_emb(%s, %s, %s, %s)",
+                (producto_id, normalizar(embedding), texto, hash_texto(OLLAMA_MODEL, texto))
+            )
+
+            conn.commit()
+            limpiar_cache_semantica()
+            invalidar_indice_local()
+
+            logger.info("Embedding guardado para producto %s", producto_id)
+
+            return jsonify({
+                'success': True,
+                'producto_id': producto_id,
+                'mensaje': 'Producto creado exitosamente con embedding'
+            }), 201
+
+        except psycopg2.IntegrityError as e:
             conn.rollback()
+            logger.error("Error de integridad: %s", e)
             return jsonify({
                 'success': False,
-                'error': 'Error generando embedding para el producto'
-            }), 500
+                'error': 'Código de producto duplicado o error de integridad'
+            }), 400
+        except Exception as e:
+            conn.rollback()
+            logger.error("Error creando producto: %s", e)
+            raise
 
-        # Convertir embedding a formato PostgreSQL
-        embedding_str = '[' + ','.join(map(str, embedding)) + ']'
 
-        # Guardar embedding
-        cur.execute("""
-            INSERT INTO producto_embeddings (producto_id, embedding, texto_embebido)
-            VALUES (%s, %s::vector(384), %s)
-        """, (producto_id, embedding_str, texto))
+@app.route('/api/productos/bulk', methods=['POST'])
+@handle_errors
+def crear_productos_bulk():
+    """
+    Crear varios productos y generar sus embeddings en lote
 
-        conn.commit()
+    Genera los embeddings con una sola llamada a Ollama y después inserta
+    los productos y sus embeddings con un único INSERT cada uno.
 
-        logger.info(f"Embedding guardado para producto {producto_id}")
+    Request JSON:
+        {
+            "productos": [
+                {"codigo": "PROD-XXX", "nombre": "Nombre del producto", ...},
+                ...
+            ]
+        }
+    """
+    data = request.json
+    productos = data.get('productos') if isinstance(data, dict) else None
 
+    # Validar campos requeridos
+    if not productos or not isinstance(productos, list):
         return jsonify({
-            'success': True,
-            'producto_id': producto_id,
-            'mensaje': 'Producto creado exitosamente con embedding'
-        }), 201
-
-    except psycopg2.IntegrityError as e:
-        conn.rollback()
-        logger.error(f"Error de integridad: {e}")
+            'success': False,
+            'error': 'Falta la lista "productos"'
+        }), 400
+
+    if len(productos) > BULK_MAXIMO:
         return jsonify({
             'success': False,
-            'error': 'Código de producto duplicado o error de integridad'
+            'error': f'Se admiten como máximo {BULK_MAXIMO} productos por petición'
+        }), 400
+
+    if not all(isinstance(p, dict) for p in productos):
+        return jsonify({
+            'success': False,
+            'error': 'Cada producto debe ser un objeto JSON'
         }), 400
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error creando producto: {e}")
-        raise
-    finally:
-        cur.close()
-        conn.close()
+
+    if any('codigo' not in p or 'nombre' not in p for p in productos):
+        return jsonify({
+            'success': False,
+            'error': 'Faltan campos requeridos: codigo, nombre'
+        }), 400
+
+    # Generar los embeddings en una sola llamada antes de tomar una conexión
+    textos = [preparar_texto_embedding(p) for p in productos]
+    embeddings = generar_embedding(textos)
+
+    if not embeddings:
+        return jsonify({
+            'success': False,
+            'error': 'Error generando embeddings para los productos'
+        }), 500
+
+    with get_conn() as conn, conn.cursor() as cur:
+        try:
+            # Insertar productos
+            filas = execute_values(cur, """
+                INSERT INTO productos
+                (codigo, nombre, descripcion, categoria, precio, stock, ubicacion, proveedor)
+                VALUES %s
+                RETURNING id, codigo
+            """, [
+                (
+                    p['codigo'],
+                    p['nombre'],
+                    p.get('descripcion'),
+                    p.get('categoria'),
+                    p.get('precio'),
+                    p.get('stock', 0),
+                    p.get('ubicacion'),
+                    p.get('proveedor')
+                )
+                for p in productos
+            ], fetch=True)
+
+            # La columna codigo es texto: un código numérico en el JSON vuelve como str
+            ids = dict((codigo, producto_id) for producto_id, codigo in filas)
+
+            logger.info("%s productos creados en lote", len(ids))
+
+            # Guardar embeddings
+            execute_values(cur, """
+                INSERT INTO producto_embeddings (producto_id, embedding, texto_embebido, texto_sha)
+                VALUES %s
+            """, [
+                (
+                    ids[str(p['codigo'])],
+                    normalizar(embedding),
+                    texto,
+                    hash_texto(OLLAMA_MODEL, texto)
+                )
+                for p, texto, embedding in zip(productos, textos, embeddings)
+            ], template=f"(%s, %s::halfvec({MODEL_DIMS}), %s, %s)")
+
+            conn.commit()
+            limpiar_cache_semantica()
+            invalidar_indice_local()
+
+            logger.info("Embeddings guardados para %s productos", len(ids))
+
+            return jsonify({
+                'success': True,
+                'producto_ids': [ids[str(p['codigo'])] for p in productos],
+                'mensaje': f'{len(ids)} productos creados exitosamente con embedding'
+            }), 201
+
+        except psycopg2.IntegrityError as e:
+            conn.rollback()
+            logger.error("Error de integridad: %s", e)
+            return jsonify({
+                'success': False,
+                'error': 'Código de producto duplicado o error de integridad'
+            }), 400
+        except Exception as e:
+            conn.rollback()
+            logger.error("Error creando productos: %s", e)
+            raise
 
 
 @app.route('/api/productos/<int:producto_id>', methods=['GET'])
@@ -408,21 +1076,22 @@ def obtener_producto(producto_id):
             "tiene_embedding": true
         }
     """
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    cur.execute("""
-        SELECT p.*, 
-               pe.id IS NOT NULL as tiene_embedding,
-               pe.fecha_generacion as embedding_fecha
-        FROM productos p
-        LEFT JOIN producto_embeddings pe ON p.id = pe.producto_id
-        WHERE p.id = %s
-    """, (producto_id,))
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT p.id, p.codigo, p.nombre, p.descripcion, p.categoria,
+                   p.precio, p.stock, p.ubicacion, p.proveedor, p.activo,
+                   p.fecha_ingreso, p.fecha_actualizacion,
+                   EXISTS (
+                       SELECT 1 FROM producto_embeddings pe WHERE pe.producto_id = p.id
+                   ) as tiene_embedding,
+                   (
+                       SELECT pe.fecha_generacion FROM producto_embeddings pe WHERE pe.producto_id = p.id
+                   ) as embedding_fecha
+            FROM productos p
+            WHERE p.id = %s
+        """, (producto_id,))
 
-    producto = cur.fetchone()
-    cur.close()
-    conn.close()
+        producto = cur.fetchone()
 
     if not producto:
         return jsonify({
@@ -460,96 +1129,97 @@ def actualizar_producto(producto_id):
             'error': 'No se proporcionaron datos para actualizar'
         }), 400
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    try:
-        # Construir query de actualización dinámicamente
-        campos_actualizar = []
-        valores = []
-
-        campos_permitidos = ['nombre', 'descripcion', 'categoria', 'precio',
-                            'stock', 'ubicacion', 'proveedor', 'activo']
-
-        for campo in campos_permitidos:
-            if campo in data:
-                campos_actualizar.append(f"{campo} = %s")
-                valores.append(data[campo])
+    with get_conn() as conn, conn.cursor() as cur:
+        try:
+            # Construir query de actualización dinámicamente
+            campos_actualizar = []
+            valores = []
+
+            campos_permitidos = ['nombre', 'descripcion', 'categoria', 'precio',
+                                'stock', 'ubicacion', 'proveedor', 'activo']
+
+            for campo in campos_permitidos:
+                if campo in data:
+                    campos_actualizar.append(f"{campo} = %s")
+                    valores.append(data[campo])
+
+            if not campos_actualizar:
+                return jsonify({
+                    'success': False,
+                    'error': 'No se proporcionaron campos válidos para actualizar'
+                }), 400
+
+            # Agregar fecha de actualización
+            campos_actualizar.append("fecha_actualizacion = CURRENT_TIMESTAMP")
+            valores.append(producto_id)
+
+            # Actualizar producto y leer en la misma consulta el hash del texto
+            # embebido, para no regenerar el embedding si el texto no cambia
+            query = f"""
+                WITH upd AS (
+                    UPDATE productos 
+                    SET {', '.join(campos_actualizar)}
+                    WHERE id = %s
+                    RETURNING id, codigo, nombre, descripcion, categoria, proveedor
+                )
+                SELECT upd.codigo, upd.nombre, upd.descripcion, upd.categoria, upd.proveedor,
+                       pe.texto_sha
+                FROM upd
+                LEFT JOIN producto_embeddings pe ON pe.producto_id = upd.id
+            """
+
+            cur.execute(query, valores)
+            producto_actualizado = cur.fetchone()
+
+            if not producto_actualizado:
+                conn.rollback()
+                return jsonify({
+                    'success': False,
+                    'error': 'Producto no encontrado'
+                }), 404
+
+            logger.info("Producto %s actualizado", producto_id)
+
+            # Regenerar embedding si cambiaron campos relevantes
+            if any(campo in data for campo in ['nombre', 'descripcion', 'categoria', 'proveedor']):
+                producto_dict = {
+                    'codigo': producto_actualizado[0],
+                    'nombre': producto_actualizado[1],
+                    'descripcion': producto_actualizado[2],
+                    'categoria': producto_actualizado[3],
+                    'proveedor': producto_actualizado[4]
+                }
+
+                texto = preparar_texto_embedding(producto_dict)
+                texto_sha = hash_texto(OLLAMA_MODEL, texto)
+                texto_sha_actual = producto_actualizado[5]
+                embedding = None
+                if texto_sha_actual is None or bytes(texto_sha_actual) != texto_sha:
+                    embedding = generar_embedding(texto)
+
+                if embedding:
+                    # Actualizar o insertar embedding
+                    cur.execute(
+                        "EXECUTE ins_emb(%s, %s, %s, %s)",
+                        (producto_id, normalizar(embedding), texto, texto_sha)
+                    )
+
+                    logger.info("Embedding regenerado para producto %s", producto_id)
+
+            conn.commit()
+            limpiar_cache_semantica()
+            invalidar_indice_local()
 
-        if not campos_actualizar:
             return jsonify({
-                'success': False,
-                'error': 'No se proporcionaron campos válidos para actualizar'
-            }), 400
+                'success': True,
+                'producto_id': producto_id,
+                'mensaje': 'Producto actualizado exitosamente'
+            })
 
-        # Agregar fecha de actualización
-        campos_actualizar.append("fecha_actualizacion = CURRENT_TIMESTAMP")
-        valores.append(producto_id)
-
-        # Actualizar producto
-        query = f"""
-            UPDATE productos 
-            SET {', '.join(campos_actualizar)}
-            WHERE id = %s
-            RETURNING codigo, nombre, descripcion, categoria, proveedor
-        """
-
-        cur.execute(query, valores)
-        producto_actualizado = cur.fetchone()
-
-        if not producto_actualizado:
+        except Exception as e:
             conn.rollback()
-            return jsonify({
-                'success': False,
-                'error': 'Producto no encontrado'
-            }), 404
-
-        logger.info(f"Producto {producto_id} actualizado")
-
-        # Regenerar embedding si cambiaron campos relevantes
-        if any(campo in data for campo in ['nombre', 'descripcion', 'categoria', 'proveedor']):
-            producto_dict = {
-                'codigo': producto_actualizado[0],
-                'nombre': producto_actualizado[1],
-                'descripcion': producto_actualizado[2],
-                'categoria': producto_actualizado[3],
-                'proveedor': producto_actualizado[4]
-            }
-
-            texto = preparar_texto_embedding(producto_dict)
-            embedding = generar_embedding(texto)
-
-            if embedding:
-                embedding_str = '[' + ','.join(map(str, embedding)) + ']'
-
-                # Actualizar o insertar embedding
-                cur.execute("""
-                    INSERT INTO producto_embeddings (producto_id, embedding, texto_embebido)
-                    VALUES (%s, %s::vector(384), %s)
-                    ON CONFLICT (producto_id) 
-                    DO UPDATE SET
-                        embedding = EXCLUDED.embedding,
-                        texto_embebido = EXCLUDED.texto_embebido,
-                        fecha_generacion = CURRENT_TIMESTAMP
-                """, (producto_id, embedding_str, texto))
-
-                logger.info(f"Embedding regenerado para producto {producto_id}")
-
-        conn.commit()
-
-        return jsonify({
-            'success': True,
-            'producto_id': producto_id,
-            'mensaje': 'Producto actualizado exitosamente'
-        })
-
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error actualizando producto: {e}")
-        raise
-    finally:
-        cur.close()
-        conn.close()
+            logger.error("Error actualizando producto: %s", e)
+            raise
 
 
 @app.route('/api/productos/<int:producto_id>', methods=['DELETE'])
@@ -561,41 +1231,38 @@ def eliminar_producto(producto_id):
     Args:
         producto_id: ID del producto
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    try:
-        cur.execute("""
-            UPDATE productos 
-            SET activo = false, fecha_actualizacion = CURRENT_TIMESTAMP
-            WHERE id = %s
-            RETURNING codigo
-        """, (producto_id,))
-
-        resultado = cur.fetchone()
+    with get_conn() as conn, conn.cursor() as cur:
+        try:
+            cur.execute("""
+                UPDATE productos 
+                SET activo = false, fecha_actualizacion = CURRENT_TIMESTAMP
+                WHERE id = %s
+                RETURNING codigo
+            """, (producto_id,))
+
+            resultado = cur.fetchone()
+
+            if not resultado:
+                conn.rollback()
+                return jsonify({
+                    'success': False,
+                    'error': 'Producto no encontrado'
+                }), 404
+
+            conn.commit()
+            limpiar_cache_semantica()
+            invalidar_indice_local()
+            logger.info("Producto %s (%s) marcado como inactivo", producto_id, resultado[0])
 
-        if not resultado:
-            conn.rollback()
             return jsonify({
-                'success': False,
-                'error': 'Producto no encontrado'
-            }), 404
-
-        conn.commit()
-        logger.info(f"Producto {producto_id} ({resultado[0]}) marcado como inactivo")
+                'success': True,
+                'mensaje': 'Producto eliminado exitosamente'
+            })
 
-        return jsonify({
-            'success': True,
-            'mensaje': 'Producto eliminado exitosamente'
-        })
-
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error eliminando producto: {e}")
-        raise
-    finally:
-        cur.close()
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            logger.error("Error eliminando producto: %s", e)
+            raise
 
 
 @app.route('/', methods=['GET'])
@@ -608,10 +1275,11 @@ def home():
         'version': '1.0.0',
         'endpoints': {
             'GET /': 'Esta documentación',
-            'GET /health': 'Estado de servicios',
+            'GET /health': 'Estado de servicios (?full=1 incluye Ollama y conteos)',
             'GET /api/productos': 'Listar productos (paginado)',
             'GET /api/productos/<id>': 'Obtener producto específico',
             'POST /api/productos': 'Crear nuevo producto',
+            'POST /api/productos/bulk': 'Crear varios productos en lote',
             'PUT /api/productos/<id>': 'Actualizar producto',
             'DELETE /api/productos/<id>': 'Eliminar producto (soft delete)',
             'POST /api/productos/buscar': 'Búsqueda semántica',
@@ -630,7 +1298,7 @@ def home():
             }
         },
         'modelo_embeddings': OLLAMA_MODEL,
-        'dimensiones': 384
+        'dimensiones': MODEL_DIMS
     })
 
 
@@ -673,64 +1341,81 @@ def obtener_sugerencias():
     })
 
 
-@app.route('/', methods=['GET'])
+@app.route('/health', methods=['GET'])
 def health_check():
     """
     Verificar estado de servicios
 
+    Por defecto es una comprobación ligera pensada para sondeos frecuentes
+    (liveness): solo hace un SELECT 1 en PostgreSQL. Con ?full=1 cuenta
+    productos y embeddings y consulta los modelos instalados en Ollama.
+
     Response:
         {
             "status": "ok/degraded/error",
             "postgres": {"status": "ok", "detail": "..."},
-            "ollama": {"status": "ok", "modelo": "all-minilm"}
+            "ollama": {"status": "ok", "modelo": "all-minilm"},  # Solo con ?full=1
+            "cache": {"status": "ok", "cache_hits": 12, "cache_misses": 3}
         }
     """
+    completo = request.args.get('full', 0, type=int) == 1
     health_status = {
-        'postgres': {'status': 'unknown'},
-        'ollama': {'status': 'unknown'}
+        'postgres': {'status': 'unknown'}
     }
 
     # Verificar PostgreSQL
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM productos")
-        productos_count = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM producto_embeddings")
-        embeddings_count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-
-        health_status['postgres'] = {
-            'status': 'ok',
-            'productos': productos_count,
-            'embeddings': embeddings_count
-        }
+        with get_conn() as conn, conn.cursor() as cur:
+            if completo:
+                cur.execute("SELECT COUNT(*) FROM productos")
+                productos_count = cur.fetchone()[0]
+                cur.execute("SELECT COUNT(*) FROM producto_embeddings")
+                embeddings_count = cur.fetchone()[0]
+            else:
+                cur.execute("SELECT 1")
+
+        health_status['postgres'] = {'status': 'ok'}
+        if completo:
+            health_status['postgres'].update({
+                'productos': productos_count,
+                'embeddings': embeddings_count
+            })
     except Exception as e:
-        logger.error(f"Error en health check PostgreSQL: {e}")
+        logger.error("Error en health check PostgreSQL: %s", e)
         health_status['postgres'] = {
             'status': 'error',
             'error': str(e)
         }
 
-    # Verificar Ollama
-    try:
-        models = ollama_client.list()
-        model_names = [m.get('name', m.get('model', '')) for m in models.get('models', [])]
-        model_disponible = any(OLLAMA_MODEL in name for name in model_names)
-
-        health_status['ollama'] = {
-            'status': 'ok' if model_disponible else 'warning',
-            'modelo_configurado': OLLAMA_MODEL,
-            'modelo_disponible': model_disponible,
-            'modelos_instalados': len(model_names)
-        }
-    except Exception as e:
-        logger.error(f"Error en health check Ollama: {e}")
-        health_status['ollama'] = {
-            'status': 'error',
-            'error': str(e)
-        }
+    # Caché de embeddings: aciertos en memoria y en Redis frente a llamadas a Ollama
+    info = _embed_cached.cache_info()
+    health_status['cache'] = {
+        'status': 'ok',
+        'cache_hits': info.hits + cache_stats['redis_hits'],
+        'cache_misses': cache_stats['misses'],
+        'en_memoria': info.currsize,
+        'redis': redis_client is not None
+    }
+
+    # Verificar Ollama (solo en la comprobación completa)
+    if completo:
+        try:
+            model_names = listar_modelos()
+            model_disponible = any(OLLAMA_MODEL in name for name in model_names)
+
+            health_status['ollama'] = {
+                'status': 'ok' if model_disponible else 'warning',
+                'modelo_configurado': OLLAMA_MODEL,
+                'modelo_disponible': model_disponible,
+                'dimensiones': MODEL_DIMS,
+                'modelos_instalados': len(model_names)
+            }
+        except Exception as e:
+            logger.error("Error en health check Ollama: %s", e)
+            health_status['ollama'] = {
+                'status': 'error',
+                'error': str(e)
+            }
 
     # Determinar estado general
     if all(s['status'] == 'ok' for s in health_status.values()):
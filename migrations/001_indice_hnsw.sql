@@ -0,0 +1,16 @@
+-- migrations/001_indice_hnsw.sql
+-- Reemplazar el índice IVFFlat por HNSW para que ORDER BY ... LIMIT use el índice
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE indexname = 'idx_producto_embeddings_vector'
+          AND indexdef NOT LIKE '%USING hnsw%'
+    ) THEN
+        DROP INDEX idx_producto_embeddings_vector;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_producto_embeddings_vector
+ON producto_embeddings
+USING hnsw (embedding vector_cosine_ops);
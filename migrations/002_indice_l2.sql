@@ -0,0 +1,21 @@
+-- migrations/002_indice_l2.sql
+-- Los embeddings se guardan normalizados: indexar por distancia L2 (<->)
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE indexname = 'idx_producto_embeddings_vector'
+          AND indexdef NOT LIKE '%vector_l2_ops%'
+    ) THEN
+        DROP INDEX idx_producto_embeddings_vector;
+    END IF;
+END $$;
+
+-- Normalizar los embeddings existentes
+UPDATE producto_embeddings
+SET embedding = l2_normalize(embedding)
+WHERE abs(vector_norm(embedding) - 1) > 1e-6;
+
+CREATE INDEX IF NOT EXISTS idx_producto_embeddings_vector
+ON producto_embeddings
+USING hnsw (embedding vector_l2_ops);
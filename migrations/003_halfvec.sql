@@ -0,0 +1,40 @@
+-- migrations/003_halfvec.sql
+-- Guardar los embeddings como halfvec (fp16): la mitad de bytes por fila e índice
+DROP INDEX IF EXISTS idx_producto_embeddings_vector;
+
+ALTER TABLE producto_embeddings
+ALTER COLUMN embedding TYPE halfvec(384) USING embedding::halfvec(384);
+
+CREATE INDEX idx_producto_embeddings_vector
+ON producto_embeddings
+USING hnsw (embedding halfvec_l2_ops);
+
+-- La función de búsqueda recibe ahora un halfvec
+DROP FUNCTION IF EXISTS buscar_productos_similares(vector, INTEGER);
+
+CREATE OR REPLACE FUNCTION buscar_productos_similares(
+    query_embedding halfvec(384),
+    limite INTEGER DEFAULT 10
+)
+RETURNS TABLE (
+    producto_id INTEGER,
+    codigo VARCHAR,
+    nombre VARCHAR,
+    descripcion TEXT,
+    similitud FLOAT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        p.id,
+        p.codigo,
+        p.nombre,
+        p.descripcion,
+        1 - (pe.embedding <=> query_embedding) as similitud
+    FROM producto_embeddings pe
+    JOIN productos p ON pe.producto_id = p.id
+    WHERE p.activo = true
+    ORDER BY pe.embedding <-> query_embedding  -- L2 sobre vectores normalizados (usa el índice)
+    LIMIT limite;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,4 @@
+-- migrations/004_texto_sha.sql
+-- Hash del texto embebido: generate_embeddings.py solo regenera los productos
+-- cuyo texto ha cambiado. Las filas existentes quedan a NULL y se regeneran una vez
+ALTER TABLE producto_embeddings ADD COLUMN IF NOT EXISTS texto_sha BYTEA;
@@ -0,0 +1,7 @@
+-- migrations/005_indice_producto_include.sql
+-- Índice por producto con fecha_generacion incluida: obtener_producto comprueba
+-- si hay embedding y su fecha con un index-only scan, sin leer la fila del vector
+DROP INDEX IF EXISTS idx_producto_embeddings_producto_id;
+
+CREATE INDEX idx_producto_embeddings_producto_id
+ON producto_embeddings(producto_id) INCLUDE (fecha_generacion);
@@ -0,0 +1,4 @@
+-- migrations/006_indice_activos_nombre.sql
+-- Índice parcial para el listado paginado (activo = true ORDER BY nombre)
+CREATE INDEX IF NOT EXISTS idx_productos_activos_nombre
+ON productos(nombre) WHERE activo = true;
@@ -0,0 +1,35 @@
+-- migrations/007_indice_producto_escalar.sql
+-- Vectores normalizados: la búsqueda ordena por producto escalar (<#>), más
+-- barato que coseno o L2. El índice HNSW pasa a halfvec_ip_ops
+DROP INDEX IF EXISTS idx_producto_embeddings_vector;
+
+CREATE INDEX idx_producto_embeddings_vector
+ON producto_embeddings
+USING hnsw (embedding halfvec_ip_ops);
+
+CREATE OR REPLACE FUNCTION buscar_productos_similares(
+    query_embedding halfvec(384),
+    limite INTEGER DEFAULT 10
+)
+RETURNS TABLE (
+    producto_id INTEGER,
+    codigo VARCHAR,
+    nombre VARCHAR,
+    descripcion TEXT,
+    similitud FLOAT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        p.id,
+        p.codigo,
+        p.nombre,
+        p.descripcion,
+        -(pe.embedding <#> query_embedding) as similitud
+    FROM producto_embeddings pe
+    JOIN productos p ON pe.producto_id = p.id
+    WHERE p.activo = true
+    ORDER BY pe.embedding <#> query_embedding  -- Producto escalar negativo sobre vectores normalizados (usa el índice)
+    LIMIT limite;
+END;
+$$ LANGUAGE plpgsql;
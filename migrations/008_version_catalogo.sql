@@ -0,0 +1,29 @@
+-- migrations/008_version_catalogo.sql
+-- Contador de cambios del catálogo para el índice local de la API. Cada
+-- escritura en productos o producto_embeddings lo incrementa en su propia
+-- transacción, así que el nuevo valor solo es visible cuando los cambios ya
+-- están confirmados (a diferencia de max(fecha_actualizacion))
+CREATE TABLE IF NOT EXISTS catalogo_version (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalogo_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION incrementar_version_catalogo()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE catalogo_version SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_version_productos
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON productos
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION incrementar_version_catalogo();
+
+CREATE OR REPLACE TRIGGER trigger_version_embeddings
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON producto_embeddings
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION incrementar_version_catalogo();
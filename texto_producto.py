@@ -0,0 +1,44 @@
+# texto_producto.py
+"""
+Preparación del texto de productos para generar embeddings
+
+Módulo separado y con anotaciones de tipo para poder compilarlo con mypyc
+(make compile). Si la extensión compilada no existe se usa este código tal cual.
+"""
+
+from typing import Any, List, Optional
+
+# Misma construcción que preparar_texto, en SQL, para calcular el hash del texto
+# de cada producto en la base de datos. Ambas versiones deben mantenerse iguales
+TEXTO_SQL = """
+    p.nombre || ' Producto: ' || p.nombre
+    || COALESCE(' Categoría: ' || NULLIF(p.categoria, '') || ' Tipo: ' || NULLIF(p.categoria, ''), '')
+    || COALESCE(' ' || NULLIF(p.descripcion, ''), '')
+    || ' Código: ' || p.codigo
+    || COALESCE(' Proveedor: ' || NULLIF(p.proveedor, ''), '')
+"""
+
+
+def preparar_texto(codigo: str, nombre: str, descripcion: Optional[str],
+                   categoria: Optional[str], proveedor: Optional[str]) -> str:
+    """Construir el texto de embedding con los campos vacíos resueltos en línea
+
+    Equivale a unir con espacios las partes no vacías, sin crear la lista
+    intermedia ni pasar por filter/join en cada producto.
+    """
+    # Repetir nombre y categoría para aumentar su peso semántico
+    return (
+        f"{nombre} Producto: {nombre}"
+        + (f" Categoría: {categoria} Tipo: {categoria}" if categoria else "")
+        + (f" {descripcion}" if descripcion else "")
+        + f" Código: {codigo}"
+        + (f" Proveedor: {proveedor}" if proveedor else "")
+    )
+
+
+def preparar_textos_lote(productos: List[Any]) -> List[str]:
+    """Preparar los textos de un lote de filas (namedtuples) de productos"""
+    return [
+        preparar_texto(p.codigo, p.nombre, p.descripcion, p.categoria, p.proveedor)
+        for p in productos
+    ]